@@ -1,2 +0,0 @@
-from frontend import *
-import tools
\ No newline at end of file
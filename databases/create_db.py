@@ -46,4 +46,7 @@ CREATE TABLE IF NOT EXISTS conversations (
 conn.commit()
 conn.close()
 
+# index_commits and document_files are defined once, in update_db.ensure_tables(), which the
+# backend runs at startup.
+
 print("Database created successfully.")
@@ -1,5 +1,5 @@
 import sqlite3
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 
 DB_PATH = "legal_ai.db"
 
@@ -23,3 +23,34 @@ def get_chunk_row(document_id: str, page_number: int, chunk_index: int) -> Optio
         return {"chunk_id": chunk_id, "document_id": doc_id}
     finally:
         conn.close()
+
+
+def get_chunk_rows(keys: List[Tuple[str, int, int]]) -> Dict[Tuple[str, int, int], Dict]:
+    """
+    Batch form of get_chunk_row: one query for many (document_id, page_number, chunk_index) keys.
+    Keys without a matching row are absent from the result.
+    """
+    unique_keys = list(dict.fromkeys(keys))
+    if not unique_keys:
+        return {}
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cur = conn.cursor()
+        rows = {}
+        # Older SQLite builds allow 999 bound parameters per statement, i.e. 333 keys.
+        for start in range(0, len(unique_keys), 333):
+            batch = unique_keys[start:start + 333]
+            placeholders = ", ".join(["(?, ?, ?)"] * len(batch))
+            params = [value for key in batch for value in key]
+            cur.execute(
+                f"""
+             SELECT chunk_id, document_id, page_number, chunk_index FROM documents
+             WHERE (document_id, page_number, chunk_index) IN (VALUES {placeholders})
+             """, params,
+            )
+            for chunk_id, doc_id, page_number, chunk_index in cur.fetchall():
+                rows.setdefault((doc_id, page_number, chunk_index), {"chunk_id": chunk_id, "document_id": doc_id})
+        return rows
+    finally:
+        conn.close()
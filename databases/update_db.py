@@ -1,6 +1,6 @@
 import sqlite3
 import uuid
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 import json
 
@@ -11,22 +11,33 @@ def _get_conn():
     conn.row_factory = sqlite3.Row
     return conn
 
+def begin_write() -> sqlite3.Connection:
+    """Connection with a write transaction already open; the caller commits or rolls back and closes it."""
+    conn = _get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    return conn
+
 def create_document_id() -> str:
     return uuid.uuid4().hex
 
-def delete_chunks_by_document_id(document_id: str) -> int:
-    conn = _get_conn()
+def delete_chunks_by_document_id(document_id: str, conn: Optional[sqlite3.Connection] = None) -> int:
+    # When a connection is passed in, the caller owns the transaction.
+    own_conn = conn is None
+    conn = conn or _get_conn()
     try:
         cur = conn.cursor()
         cur.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
         deleted = cur.rowcount
-        conn.commit()
+        if own_conn:
+            conn.commit()
         return deleted
     finally:
-        conn.close()
+        if own_conn:
+            conn.close()
 
-def insert_chunks(document_id: str, title: str, chunks: List[Dict[str,Any]]) -> int:
-    conn = _get_conn()
+def insert_chunks(document_id: str, title: str, chunks: List[Dict[str,Any]], conn: Optional[sqlite3.Connection] = None) -> int:
+    own_conn = conn is None
+    conn = conn or _get_conn()
     try:
         cur = conn.cursor()
         inserted = 0
@@ -43,10 +54,12 @@ def insert_chunks(document_id: str, title: str, chunks: List[Dict[str,Any]]) ->
             )
             inserted += 1
     
-        conn.commit()
+        if own_conn:
+            conn.commit()
         return inserted
     finally:
-        conn.close()
+        if own_conn:
+            conn.close()
 
 def get_all_chunks() -> List[Dict[str, Any]]:
     conn = _get_conn()
@@ -70,6 +83,90 @@ def get_all_chunks() -> List[Dict[str, Any]]:
     finally:
         conn.close()
 
+def count_chunks() -> int:
+    conn = _get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM documents")
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+def ensure_tables() -> None:
+    # Tables added after create_db.py was first run on existing databases.
+    conn = _get_conn()
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS index_commits (
+                txn_id TEXT PRIMARY KEY,
+                version TEXT,
+                committed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS document_files (
+                content_hash TEXT PRIMARY KEY,
+                document_id TEXT,
+                title,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_document_by_hash(content_hash: str) -> Optional[Dict[str, Any]]:
+    """Document previously ingested from a file with this SHA-256, if its chunks still exist."""
+    conn = _get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT f.document_id, f.title, COUNT(d.chunk_id) AS chunks_count
+            FROM document_files f
+            JOIN documents d ON d.document_id = f.document_id
+            WHERE f.content_hash = ?
+            GROUP BY f.document_id, f.title
+            """,
+            (content_hash,),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return {"document_id": row["document_id"], "title": row["title"], "chunks_count": row["chunks_count"]}
+    finally:
+        conn.close()
+
+def record_document_hash(content_hash: str, document_id: str, title: str, conn: sqlite3.Connection) -> None:
+    conn.execute("DELETE FROM document_files WHERE document_id = ?", (document_id,))
+    conn.execute(
+        "INSERT OR REPLACE INTO document_files (content_hash, document_id, title, created_at) VALUES (?, ?, ?, ?)",
+        (content_hash, document_id, title, datetime.now()),
+    )
+
+def record_index_commit(txn_id: str, version: str, conn: sqlite3.Connection) -> None:
+    # Written in the same transaction as the chunk rows, so its presence proves they were committed.
+    conn.execute(
+        "INSERT INTO index_commits (txn_id, version, committed_at) VALUES (?, ?, ?)",
+        (txn_id, version, datetime.now()),
+    )
+
+def get_index_commit(txn_id: str) -> Optional[Dict[str, Any]]:
+    conn = _get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT txn_id, version FROM index_commits WHERE txn_id = ?", (txn_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return {"txn_id": row["txn_id"], "version": row["version"]}
+    finally:
+        conn.close()
+
 def start_new_conversation(document_id: str, chunk_id: str, user_query: str, llm_response: str):
     conn = _get_conn()
     conversation_id = uuid.uuid4().hex
@@ -1,10 +1,11 @@
 from fastapi import FastAPI
-from router import process_pdf, query_router
+from router import process_pdf, query_router, health
 
 app = FastAPI(lifespan=query_router.lifespan)
 
 app.include_router(process_pdf.router)
 app.include_router(query_router.router)
+app.include_router(health.router)
 
 from fastapi.middleware.cors import CORSMiddleware
 
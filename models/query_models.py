@@ -4,6 +4,7 @@ from typing import List, Optional
 class QueryInput(BaseModel):
     question: str
     top_k: int = 1
+    flush_ms: Optional[int] = None
 
 class ChunkMetadata(BaseModel):
     page_number: Optional[int]
@@ -20,6 +21,12 @@ class QueryResponse(BaseModel):
     retrieved_chunks: List[RetrievedChunks]
     response: str
 
+class QueryBatchInput(BaseModel):
+    questions: List[str]
+    top_k: int = 1
+    max_concurrency: Optional[int] = None
+
 class QueryChatInput(BaseModel):
     question: str
     conversation_id: str
+    flush_ms: Optional[int] = None
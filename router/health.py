@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from services.warmup import readiness
+
+router = APIRouter()
+
+
+@router.get("/healthz")
+async def healthz():
+    # Liveness only: the process is up and serving HTTP.
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz():
+    # 503 until warm-up has loaded the model and index, so load balancers skip cold workers.
+    state = readiness()
+    status_code = 200 if state["ready"] else 503
+    return JSONResponse(status_code=status_code, content=dict(state, status="ready" if state["ready"] else "warming"))
@@ -1,18 +1,64 @@
 from fastapi import HTTPException, APIRouter, UploadFile, File, Form
 from services.pdf_parser import pdf_extraction
 from services.chunking import chunk_extracted_text
-from services.embeddings import chunk_storage
-from databases.update_db import create_document_id, insert_chunks, delete_chunks_by_document_id, get_all_chunks
-import tempfile
-import os
+from services.index_writer import get_index_writer
+from databases.update_db import create_document_id, get_document_by_hash
+from starlette.concurrency import run_in_threadpool
+import mmap
+import asyncio
+import hashlib
+from contextlib import contextmanager
 from datetime import datetime
 from router.query_router import reload_index
 from typing import Optional
 
 router = APIRouter()
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 #pdf_path = "source_docs/Consitution of India.pdf"
 
+def _hash_upload(spooled) -> str:
+    spooled.seek(0)
+    hasher = hashlib.sha256()
+    while True:
+        block = spooled.read(UPLOAD_CHUNK_SIZE)
+        if not block:
+            break
+        hasher.update(block)
+    return hasher.hexdigest()
+
+@contextmanager
+def _upload_view(spooled):
+    """
+    View the spooled upload where it already is: the in-memory buffer while Starlette still holds
+    it in memory, or a read-only mmap of its temporary file once it has rolled over to disk.
+    """
+    if not getattr(spooled, "_rolled", True):
+        view = spooled._file.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+
+    spooled.flush()
+    if spooled.seek(0, 2) == 0:
+        # mmap cannot map an empty file; PyMuPDF reports the empty stream itself.
+        yield b""
+        return
+    mapped = mmap.mmap(spooled.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        yield view
+    finally:
+        view.release()
+        mapped.close()
+
+def _parse_upload(spooled) -> list:
+    with _upload_view(spooled) as view:
+        return pdf_extraction(stream=view)
+
 @router.post("/process-pdf")
 async def process_pdf(
     file: UploadFile = File(...),
@@ -22,48 +68,51 @@ async def process_pdf(
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Please Upload PDF")
     
-    tmp_path = None
-
     try:
-        suffix = os.path.splitext(file.filename)[1] or ".pdf"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp_path = tmp.name
-            contents = await file.read()
-            tmp.write(contents)
+        # Starlette has already spooled the upload (to disk past 1 MiB). Hash it in a second pass
+        # over the spool, in blocks, so a duplicate is answered before anything is parsed.
+        content_hash = await run_in_threadpool(_hash_upload, file.file)
+        existing = await run_in_threadpool(get_document_by_hash, content_hash)
+        if existing and (not document_id or existing["document_id"] == document_id):
+            return {
+                "message": "PDF already ingested; returning the existing document.",
+                "document_id": existing["document_id"],
+                 "title": existing["title"],
+                "chunks_count": existing["chunks_count"],
+                "deduplicated": True
+            }
 
-        pages = pdf_extraction(tmp_path)
+        # PyMuPDF reads a memoryview in place, so the PDF is never copied into a bytes object.
+        pages = await run_in_threadpool(_parse_upload, file.file)
         chunks = chunk_extracted_text(pages)
         
+        # All index mutations go through the single writer so concurrent uploads cannot
+        # overwrite each other's vectors; the commit is coalesced with any other pending uploads.
         if document_id:
-            delete_chunks_by_document_id(document_id)
-            insert_count = insert_chunks(document_id=document_id, title=title, chunks=chunks)
-            
-            all_chunks = get_all_chunks()
-            chunk_storage(all_chunks, persist_path = "faiss_index", document_id=None, overwrite=True)
-            reload_index()
+            result = await asyncio.wrap_future(
+                get_index_writer().submit(document_id, title, chunks, replace=True, content_hash=content_hash)
+            )
+            await run_in_threadpool(reload_index)
 
             return {
                 "message": "Existing document overwritten, chunked, and stored in DB and FAISS successfully.",
-                "document_id": document_id,
+                "document_id": result["document_id"],
                  "title": title,
-                "chunks_count": insert_count
+                "chunks_count": result["chunks_count"],
+                "deduplicated": result["deduplicated"]
             }
         
         new_doc_id = create_document_id()
-        insert_count = insert_chunks(document_id=new_doc_id, title=title, chunks=chunks)
-        chunk_storage(chunks, persist_path="faiss_index", document_id=new_doc_id, overwrite=False)
-        reload_index()
+        result = await asyncio.wrap_future(
+            get_index_writer().submit(new_doc_id, title, chunks, replace=False, content_hash=content_hash)
+        )
+        await run_in_threadpool(reload_index)
         return {
                 "message": "PDF parsed, chunked, and stored in DB and FAISS successfully.",
-                "document_id": document_id,
+                "document_id": result["document_id"],
                  "title": title,
-                "chunks_count": insert_count
+                "chunks_count": result["chunks_count"],
+                "deduplicated": result["deduplicated"]
             }
     except Exception as e:
         raise HTTPException(status_code = 500, detail=str(e))
-    finally:
-        try:
-            if tmp_path and os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
\ No newline at end of file
@@ -2,21 +2,21 @@ import os
 import time
 import json
 import logging
-import pickle
-import threading
 import asyncio
 from contextlib import contextmanager, asynccontextmanager
 from typing import Optional, List, Dict, Any
-from starlette.concurrency import run_in_threadpool
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 
-from fastapi import HTTPException, APIRouter, BackgroundTasks
+from fastapi import HTTPException, APIRouter, BackgroundTasks, Request
 from fastapi.responses import StreamingResponse
 
-import faiss
-from sentence_transformers import SentenceTransformer
-
-from models.query_models import QueryInput, QueryResponse, ChunkMetadata, RetrievedChunks, QueryChatInput
-from services.query_engine import chunk_retrieval, llm_response, llm_chat_response
+from models.query_models import QueryInput, QueryResponse, ChunkMetadata, RetrievedChunks, QueryChatInput, QueryBatchInput
+from services.query_engine import chunk_retrieval, llm_response, llm_chat_response, load_index
+from services import index_store
+from services.warmup import warm_up_until_ready, index_reconciled
+from services.batch_query import run_batch, BATCH_MAX_QUESTIONS
+from services.sse import sse_event, coalesce_tokens, flush_interval, DONE_EVENT
+from services.llm_scheduler import llm_scheduler, QueueFullError, PRIORITY_NORMAL, PRIORITY_FOLLOW_UP
 from databases.extract_db import get_chunk_row
 from databases.update_db import start_new_conversation, update_conversation
 
@@ -33,76 +33,58 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Module-level globals (populated at startup or by reload_index)
-faiss_index = None
-docstore = None
-embedding_model = None
-
-# A lock used to avoid read/write races between index rebuilds and query handling
-_index_lock = threading.Lock()
+# Default root for persisted index snapshots
+DEFAULT_PERSIST_DIR = index_store.DEFAULT_INDEX_ROOT
 
-# Default paths for persisted index and docstore
-DEFAULT_PERSIST_DIR = "faiss_index"
-DEFAULT_INDEX_PATH = os.path.join(DEFAULT_PERSIST_DIR, "index.faiss")
-DEFAULT_DOCSTORE_PATH = os.path.join(DEFAULT_PERSIST_DIR, "index.pkl")
+# Follow-up questions in an open chat jump ahead of new questions when the LLM is saturated
+LLM_PRIORITIZE_FOLLOW_UPS = os.getenv("LLM_PRIORITIZE_FOLLOW_UPS", "1") == "1"
 
+# How often each worker checks the manifest for a newly published snapshot
+INDEX_POLL_INTERVAL = float(os.getenv("INDEX_POLL_INTERVAL", "2"))
 
-@asynccontextmanager
-async def lifespan(app):
 
-    global faiss_index, docstore, embedding_model
+async def _watch_index(persist_dir: str):
+    """
+    Poll the snapshot manifest and hot-swap the served index when another worker publishes.
+    Also keeps this worker's lease fresh and garbage-collects snapshots nobody uses any more.
+    """
+    while True:
+        try:
+            if not index_reconciled.is_set() or index_store.current_snapshot_path(persist_dir) is None:
+                await asyncio.sleep(INDEX_POLL_INTERVAL)
+                continue
+            version = await run_in_threadpool(load_index, persist_dir)
+            if version:
+                await run_in_threadpool(index_store.write_lease, version, persist_dir)
+            await run_in_threadpool(index_store.collect_garbage, persist_dir)
+        except Exception as e:
+            logger.error(f"Index watcher iteration failed: {str(e)}")
+        await asyncio.sleep(INDEX_POLL_INTERVAL)
 
-    logger.info("Loading FAISS Index and Docstore at startup")
 
-    index_path = DEFAULT_INDEX_PATH
-    docstore_path = DEFAULT_DOCSTORE_PATH
+@asynccontextmanager
+async def lifespan(app):
 
-    # If index exists, load it; else leave globals None and rely on on-demand creation.
-    if os.path.exists(index_path) and os.path.exists(docstore_path):
-        with _index_lock:
-            try:
-                faiss_index = faiss.read_index(index_path)
-                with open(docstore_path, "rb") as f:
-                    docstore = pickle.load(f)
-            except Exception as e:
-                logger.error(
-                    "Failed to load persisted FAISS index/docstore. "
-                    "They will be rebuilt on demand.",
-                    exc_info=e
-                )
-                faiss_index = None
-                docstore = None
-        logger.info("Loaded existing FAISS index and docstore.")
-    else:
-        logger.info("FAISS index or docstore not found at startup; will be created on demand.")
-
-    # Load embedding model (SentenceTransformer) for any local embedding needs
-    embedding_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-    logger.info("Embedding model loaded successfully.")
+    # Warm-up (crash recovery, model, index, Ollama) runs in the background so /healthz
+    # answers at once; /readyz reports 503 until it succeeds, retrying with backoff on failure.
+    warmup = asyncio.create_task(warm_up_until_ready(DEFAULT_PERSIST_DIR))
+    watcher = asyncio.create_task(_watch_index(DEFAULT_PERSIST_DIR))
 
     yield
 
     logger.info("Shutting down")
+    watcher.cancel()
+    warmup.cancel()
+    index_store.release_lease(DEFAULT_PERSIST_DIR)
 
 
-def reload_index(index_path: Optional[str] = None, docstore_path: Optional[str] = None) -> None:
-
-    global faiss_index, docstore
-
-    index_path = index_path or DEFAULT_INDEX_PATH
-    docstore_path = docstore_path or DEFAULT_DOCSTORE_PATH
-
-    with _index_lock:
-        if not os.path.exists(index_path) or not os.path.exists(docstore_path):
-            raise RuntimeError(f"Index files not found for reload: {index_path}, {docstore_path}")
-
-        # Read FAISS index and pickle docstore
-        faiss_index = faiss.read_index(index_path)
-
-        with open(docstore_path, "rb") as f:
-            docstore = pickle.load(f)
-
-        logger.info("FAISS index and docstore reloaded into memory.")
+def reload_index(persist_dir: Optional[str] = None) -> None:
+    """Swap in the current snapshot immediately in this worker; other workers pick it up on their next poll."""
+    persist_dir = persist_dir or DEFAULT_PERSIST_DIR
+    version = load_index(persist_dir)
+    if version:
+        index_store.write_lease(version, persist_dir)
+    logger.info("FAISS index and docstore reloaded into memory.")
 
 
 @contextmanager
@@ -119,8 +101,28 @@ def log_step(message: str, step_start: float):
         pass
 
 
+def _client_id(request: Request) -> str:
+    # No auth yet: an explicit header wins, otherwise fairness is per client address.
+    return request.headers.get("x-user-id") or (request.client.host if request.client else "anonymous")
+
+
+def _admit(request: Request, priority: int):
+    """Reserve an LLM slot (or queue place) before the stream starts, so overload is a fast 429/503."""
+    try:
+        return llm_scheduler.submit(_client_id(request), priority)
+    except QueueFullError as e:
+        logger.info(f"Rejected LLM request ({e.status_code}): {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+
+async def _release_ticket(ticket) -> None:
+    # Async so it runs on the event loop thread, which owns the scheduler state. Scheduled as a
+    # background task too, because a client that disconnects early may never start the generator.
+    ticket.release()
+
+
 @router.post("/query/stream")
-async def query_vector_store_stream(query_input: QueryInput, background_tasks: BackgroundTasks):
+async def query_vector_store_stream(query_input: QueryInput, background_tasks: BackgroundTasks, request: Request):
     """
     Streaming variant of the query endpoint with slightly different token generator semantics.
     """
@@ -128,6 +130,10 @@ async def query_vector_store_stream(query_input: QueryInput, background_tasks: B
     logger.info("=" * 60)
     logger.info(f"New streaming query request: '{query_input.question}'")
 
+    # Admit before retrieval so an overloaded server rejects without embedding or searching.
+    ticket = _admit(request, PRIORITY_NORMAL)
+    background_tasks.add_task(_release_ticket, ticket)
+
     try:
         step_start_1 = time.perf_counter()
         chunks = chunk_retrieval(query_input.question, k=query_input.top_k)
@@ -159,15 +165,19 @@ async def query_vector_store_stream(query_input: QueryInput, background_tasks: B
             
             try:
                 try:
-                    yield f"data: {json.dumps({'source': top_meta_local.dict()})}\n\n"
+                    yield sse_event({'source': top_meta_local.dict()})
                 except Exception:
                     pass
 
-                for token in llm_response(top_chunk_local, query_input_local.question):
-                    accumulated_tokens.append(token)
-                    yield f"data: {json.dumps({'token': token})}\n\n"
-                    await asyncio.sleep(0)
-                
+                async for position in ticket.wait():
+                    yield sse_event({'queue_position': position})
+
+                tokens = iterate_in_threadpool(llm_response(top_chunk_local, query_input_local.question))
+                async for text in coalesce_tokens(tokens, flush_interval(query_input_local.flush_ms)):
+                    accumulated_tokens.append(text)
+                    yield sse_event({'token': text})
+
+                ticket.release()
                 full_response = "".join(accumulated_tokens)
 
                 doc_id = getattr(top_meta_local, "document_id", None)
@@ -204,23 +214,29 @@ async def query_vector_store_stream(query_input: QueryInput, background_tasks: B
                     "chunk_id": chunk_id,
                     "conversation_id": conversation_id
                 }
-                yield f"data: {json.dumps(final_event)}\n\n"
+                yield sse_event(final_event)
                 
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield sse_event({'error': str(e)})
             finally:
-                yield "data: [DONE]\n\n"
+                ticket.release()
+                yield DONE_EVENT
 
         log_step("Streaming Response Started", step_start_4)
 
         return StreamingResponse(token_generator(top_chunk, top_meta, query_input), media_type="text/event-stream")
 
+    except HTTPException:
+        # No response is sent, so the background release never runs.
+        ticket.release()
+        raise
     except Exception as e:
+        ticket.release()
         logger.error(f"Query stream failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     
 @router.post("/chat/stream")
-async def chat_stream(query_input: QueryChatInput, background_tasks: BackgroundTasks):
+async def chat_stream(query_input: QueryChatInput, background_tasks: BackgroundTasks, request: Request):
     conversation_id = getattr(query_input, "conversation_id", None)
     question = getattr(query_input, "question", None)
 
@@ -231,23 +247,26 @@ async def chat_stream(query_input: QueryChatInput, background_tasks: BackgroundT
     
     logger.info("Starting chat_stream for conversation_id=%s", conversation_id)
 
-    async def token_generator(conv_id: str, q: str):
+    ticket = _admit(request, PRIORITY_FOLLOW_UP if LLM_PRIORITIZE_FOLLOW_UPS else PRIORITY_NORMAL)
+    background_tasks.add_task(_release_ticket, ticket)
+
+    async def token_generator(conv_id: str, q: str, flush_ms: Optional[int]):
         accumulated = []
 
         try:
-            for token in llm_chat_response(conv_id, q):
-                if isinstance(token, str) and token.startswith("Error:"):
-                    yield f"data : {json.dumps({'error': token})}\n\n"
-                    break
+            async for position in ticket.wait():
+                yield sse_event({'queue_position': position})
 
-                try:
-                    yield f"data: {json.dumps({'token': token})}\n\n"
-                except Exception:
-                    yield f"data: {json.dumps({'token': str(token)})}\n\n"
+            tokens = iterate_in_threadpool(llm_chat_response(conv_id, q))
+            async for text in coalesce_tokens(tokens, flush_interval(flush_ms)):
+                if not accumulated and text.startswith("Error:"):
+                    yield sse_event({'error': text})
+                    break
 
-                accumulated.append(str(token))
-                time.sleep(0)
+                yield sse_event({'token': text})
+                accumulated.append(text)
 
+            ticket.release()
             full_response = "".join(accumulated)
 
             try:
@@ -256,13 +275,39 @@ async def chat_stream(query_input: QueryChatInput, background_tasks: BackgroundT
                     logger.exception("Failed to schedule update_conversation for %s: %s", conv_id, e)
 
             final_event = {"final_response": full_response, "conversation_id": conv_id}
-            yield f"data: {json.dumps(final_event)}\n\n"
+            yield sse_event(final_event)
 
         except Exception as e:
             logger.exception("chat_stream token_generator error for %s: %s", conv_id, e)
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield sse_event({'error': str(e)})
         finally:
-            yield "data: [DONE]\n\n"
+            ticket.release()
+            yield DONE_EVENT
     
-    return StreamingResponse(token_generator(conversation_id, question), media_type="text/event-stream")
-        
\ No newline at end of file
+    return StreamingResponse(token_generator(conversation_id, question, query_input.flush_ms), media_type="text/event-stream")
+
+
+@router.post("/query/batch")
+async def query_batch(batch_input: QueryBatchInput, request: Request):
+    """
+    Answer many questions in one request. Retrieval is batched; answers stream back as NDJSON
+    lines, in completion order, each tagged with the index of its question.
+    """
+    if not batch_input.questions:
+        raise HTTPException(status_code=400, detail="questions must not be empty")
+    if len(batch_input.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+
+    logger.info(f"New batch query request with {len(batch_input.questions)} questions")
+    user_id = f"batch:{_client_id(request)}"
+
+    async def ndjson_generator():
+        try:
+            async for result in run_batch(batch_input.questions, batch_input.top_k,
+                                          batch_input.max_concurrency, user_id):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            logger.exception("Batch query failed")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(ndjson_generator(), media_type="application/x-ndjson")
@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+from starlette.concurrency import run_in_threadpool
+
+from services.query_engine import batch_chunk_retrieval, llm_response
+from services.llm_scheduler import llm_scheduler, QueueFullError, LLM_MAX_QUEUE_PER_USER
+from databases.extract_db import get_chunk_rows
+
+logger = logging.getLogger(__name__)
+
+# Generations one batch runs at once. Capped by the per-user queue limit so a batch never
+# trips its own 429; the shared scheduler still interleaves it fairly with interactive users.
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "2"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+
+
+def _chunk_key(metadata: Dict[str, Any]):
+    try:
+        return (metadata["document_id"], int(metadata["page_number"]), int(metadata["chunk_index"]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+async def _generate(chunk: str, question: str, user_id: str) -> str:
+    while True:
+        try:
+            ticket = llm_scheduler.submit(user_id)
+            break
+        except QueueFullError as e:
+            await asyncio.sleep(e.retry_after)
+    try:
+        async for _ in ticket.wait():
+            pass
+        return await run_in_threadpool(lambda: "".join(llm_response(chunk, question)))
+    finally:
+        ticket.release()
+
+
+async def run_batch(questions: List[str], top_k: int = 1, max_concurrency: Optional[int] = None,
+                    user_id: str = "batch") -> AsyncIterator[Dict[str, Any]]:
+    """
+    Answer many questions with shared retrieval work, yielding one result per question in
+    completion order. Each result carries the question's index so callers can reorder.
+    """
+    concurrency = max_concurrency or BATCH_MAX_CONCURRENCY
+    concurrency = max(1, min(concurrency, LLM_MAX_QUEUE_PER_USER))
+
+    retrieved = await run_in_threadpool(batch_chunk_retrieval, questions, k=top_k)
+    keys = [_chunk_key(chunks[0]["metadata"]) if chunks else None for chunks in retrieved]
+    chunk_rows = await run_in_threadpool(get_chunk_rows, [key for key in keys if key])
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(index: int) -> Dict[str, Any]:
+        question = questions[index]
+        chunks = retrieved[index]
+        result = {"index": index, "question": question}
+        if not chunks:
+            result["error"] = "No matching chunk found"
+            return result
+
+        row = chunk_rows.get(keys[index]) if keys[index] else None
+        result.update({
+            "source": chunks[0]["metadata"],
+            "document_id": row["document_id"] if row else None,
+            "chunk_id": row["chunk_id"] if row else None,
+        })
+        try:
+            async with semaphore:
+                result["response"] = await _generate(chunks[0]["content"], question, user_id)
+        except Exception as e:
+            logger.exception("Batch question %d failed", index)
+            result["error"] = str(e)
+        return result
+
+    tasks = [asyncio.ensure_future(answer(i)) for i in range(len(questions))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _main(args) -> None:
+    with open(args.questions_file, "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        async for result in run_batch(questions, top_k=args.top_k, max_concurrency=args.concurrency):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    # python -m services.batch_query questions.txt -o answers.ndjson
+    parser = argparse.ArgumentParser(description="Answer a file of questions (one per line) as NDJSON.")
+    parser.add_argument("questions_file")
+    parser.add_argument("-o", "--output", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--top-k", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=None)
+    asyncio.run(_main(parser.parse_args()))
@@ -1,23 +1,223 @@
 import os
-import shutil
-import tempfile
+import time
+import logging
+import threading
 from typing import Optional, List, Dict, Any
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.schema import Document
-from langchain_community.vectorstores import FAISS
-
-def chunk_storage(chunks: List[Dict[str, Any]],
-    persist_path: str = "faiss_index",
-    document_id: Optional[str] = None,
-    overwrite: bool = False,):
-    if overwrite:
-        try:
-            if os.path.exists(persist_path):
-                shutil.rmtree(persist_path)
-        except Exception as e:
-            raise RuntimeError(f"Failed to remove existing persist_path {persist_path} : {e}")
-    
-    docs = [
+import numpy as np
+from filelock import FileLock
+from langchain_core.embeddings import Embeddings
+from services import index_store
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# "torch" (default), "onnx" or "onnx-int8"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join("onnx_models", "all-MiniLM-L6-v2"))
+# 0 lets ONNX Runtime pick one thread per physical core
+ONNX_NUM_THREADS = int(os.getenv("ONNX_NUM_THREADS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+# Existing indexes were built with the PyTorch model; a backend that drifts further than
+# this from it (cosine similarity) is rejected in favour of PyTorch.
+EMBEDDING_PARITY_CHECK = os.getenv("EMBEDDING_PARITY_CHECK", "1") == "1"
+EMBEDDING_PARITY_MIN_COSINE = float(os.getenv("EMBEDDING_PARITY_MIN_COSINE", "0.99"))
+
+PARITY_SAMPLE_TEXTS = [
+    "What does Article 21 of the Constitution protect?",
+    "Equality before law and equal protection of laws.",
+    "The President shall be elected by the members of an electoral college.",
+    "Can the state impose reasonable restrictions on freedom of speech?",
+    "Right to constitutional remedies",
+]
+
+
+def _write_atomic(path: str, write) -> None:
+    # Exporters write the file in place; write beside it and rename so a crash never leaves a
+    # truncated model where the next start would accept it.
+    tmp_path = path + ".tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def export_onnx_model(model_dir: str = ONNX_MODEL_DIR, quantize: bool = False) -> str:
+    """
+    Export MODEL_NAME to ONNX (once) and optionally derive a dynamically quantized int8 copy.
+    Returns the path of the requested model file. Safe to call from several workers at once:
+    the first one exports under a file lock and the others wait for its result.
+    """
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    int8_path = os.path.join(model_dir, "model-int8.onnx")
+    model_path = int8_path if quantize else fp32_path
+    if os.path.exists(model_path):
+        return model_path
+
+    os.makedirs(model_dir, exist_ok=True)
+    with FileLock(model_dir.rstrip(os.sep) + ".lock"):
+        if not os.path.exists(fp32_path):
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+            model = AutoModel.from_pretrained(MODEL_NAME).eval()
+            # Before the model file, so model.onnx existing implies the tokenizer is complete.
+            tokenizer.save_pretrained(model_dir)
+
+            sample = tokenizer(["export"], return_tensors="pt")
+            _write_atomic(fp32_path, lambda path: torch.onnx.export(
+                model,
+                (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+                path,
+                input_names=["input_ids", "attention_mask", "token_type_ids"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "token_type_ids": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"},
+                },
+                opset_version=14,
+            ))
+            logger.info("Exported %s to %s", MODEL_NAME, fp32_path)
+
+        if quantize and not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            _write_atomic(int8_path, lambda path: quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8))
+            logger.info("Wrote int8 dynamically quantized model to %s", int8_path)
+
+    return model_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    MiniLM sentence embeddings through ONNX Runtime: batched fast tokenization, mean pooling
+    and L2 normalisation, matching the SentenceTransformer pipeline of MODEL_NAME.
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, quantize: bool = False,
+                 num_threads: int = ONNX_NUM_THREADS, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_length: int = 256):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = export_onnx_model(model_dir, quantize=quantize)
+        self.model_path = model_path
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + self.batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+            hidden = self.session.run(None, feeds)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype(np.float32))
+        if not outputs:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack(outputs)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def _torch_embeddings() -> Embeddings:
+    # Deferred: importing it drags in torch and sentence-transformers.
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=MODEL_NAME,
+        encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE},
+    )
+
+
+def check_embedding_parity(candidate: Embeddings, reference: Optional[Embeddings] = None,
+                           texts: Optional[List[str]] = None) -> float:
+    """Lowest cosine similarity between candidate and reference (PyTorch) embeddings of texts."""
+    reference = reference or _torch_embeddings()
+    texts = texts or PARITY_SAMPLE_TEXTS
+    a = np.array(candidate.embed_documents(texts), dtype=np.float32)
+    b = np.array(reference.embed_documents(texts), dtype=np.float32)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    return float((a * b).sum(axis=1).min())
+
+
+def cached_parity(candidate: "OnnxEmbeddings") -> float:
+    """
+    check_embedding_parity for an exported model file, computed once and stored next to it so
+    later processes never need to load PyTorch. Re-exporting the model invalidates the marker.
+    """
+    marker_path = candidate.model_path + ".parity.json"
+    model_mtime = os.path.getmtime(candidate.model_path)
+
+    marker = index_store.read_json(marker_path)
+    if marker and marker.get("model_mtime") == model_mtime:
+        return marker["min_cosine"]
+
+    cosine = check_embedding_parity(candidate)
+    index_store.write_json_atomic(marker_path, {"min_cosine": cosine, "model_mtime": model_mtime})
+    return cosine
+
+
+_embeddings: Optional[Embeddings] = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> Embeddings:
+    """Process-wide embedding model for the configured EMBEDDING_BACKEND."""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is not None:
+            return _embeddings
+
+        if EMBEDDING_BACKEND in ("onnx", "onnx-int8"):
+            try:
+                candidate = OnnxEmbeddings(quantize=EMBEDDING_BACKEND == "onnx-int8")
+                if EMBEDDING_PARITY_CHECK:
+                    cosine = cached_parity(candidate)
+                    if cosine < EMBEDDING_PARITY_MIN_COSINE:
+                        raise RuntimeError(f"parity check failed (min cosine {cosine:.4f})")
+                    logger.info("%s embeddings match PyTorch (min cosine %.4f)", EMBEDDING_BACKEND, cosine)
+                _embeddings = candidate
+                return _embeddings
+            except Exception as e:
+                logger.error(f"ONNX embedding backend unavailable, using PyTorch: {e}")
+
+        _embeddings = _torch_embeddings()
+        return _embeddings
+
+
+def _to_documents(chunks: List[Dict[str, Any]], document_id: Optional[str] = None) -> list:
+    from langchain.schema import Document
+
+    return [
         Document(
             page_content=chunk["content"],
             metadata={"page_number": chunk["page_number"], "chunk_index": chunk["chunk_index"], "document_id": chunk.get("document_id", document_id)}
@@ -25,57 +225,50 @@ def chunk_storage(chunks: List[Dict[str, Any]],
         for chunk in chunks
     ]
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
-    )
+def build_snapshot(chunks: List[Dict[str, Any]],
+    staging_dir: str,
+    base_path: Optional[str] = None,
+    document_id: Optional[str] = None,):
+    """
+    Write a complete FAISS index into staging_dir: base_path's vectors plus chunks, or chunks alone.
+    base_path itself is only read.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    docs = _to_documents(chunks, document_id)
 
-    if overwrite:
-        
-        tmp_dir = tempfile.mkdtemp(prefix="faiss_tmp_")
-        try:
-            vectorstore = FAISS.from_documents(docs, embeddings)
-            vectorstore.save_local(tmp_dir)
-
-            
-            if os.path.exists(persist_path):
-                shutil.rmtree(persist_path)
-            
-            os.replace(tmp_dir, persist_path)
-        except Exception as e:
-            
-            if os.path.exists(tmp_dir):
-                try:
-                    shutil.rmtree(tmp_dir)
-                except Exception:
-                    pass
-            raise RuntimeError(f"Failed to build & swap FAISS index: {e}")
+    embeddings = get_embeddings()
 
+    if base_path:
+        # A base that cannot be read raises; building from chunks alone would drop its vectors.
+        vectorstore = FAISS.load_local(base_path, embeddings, allow_dangerous_deserialization=True)
+        if docs:
+            vectorstore.add_documents(docs)
     else:
-        
-        if os.path.exists(persist_path):
-            try:
-                vectorstore = FAISS.load_local(persist_path, embeddings)
-                vectorstore.add_documents(docs)
-                vectorstore.save_local(persist_path)
-            except Exception:
-                
-                tmp_dir = tempfile.mkdtemp(prefix="faiss_tmp_")
-                try:
-                    new_vs = FAISS.from_documents(docs, embeddings)
-                    new_vs.save_local(tmp_dir)
-                    if os.path.exists(persist_path):
-                        shutil.rmtree(persist_path)
-                    os.replace(tmp_dir, persist_path)
-                except Exception as e:
-                    if os.path.exists(tmp_dir):
-                        try:
-                            shutil.rmtree(tmp_dir)
-                        except Exception:
-                            pass
-                    raise RuntimeError(f"Failed to append or recreate FAISS index: {e}")
-        else:
-            
-            vectorstore = FAISS.from_documents(docs, embeddings)
-            vectorstore.save_local(persist_path)
-
-    return True
\ No newline at end of file
+        vectorstore = FAISS.from_documents(docs, embeddings)
+    vectorstore.save_local(staging_dir)
+    return vectorstore.index.ntotal
+
+
+def _benchmark(texts: List[str], embeddings: Embeddings) -> Dict[str, float]:
+    start = time.perf_counter()
+    embeddings.embed_documents(texts)
+    ingest = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for text in texts[:50]:
+        embeddings.embed_query(text)
+    query = (time.perf_counter() - start) / min(len(texts), 50)
+    return {"docs_per_sec": len(texts) / ingest, "query_ms": query * 1000}
+
+
+if __name__ == "__main__":
+    # python -m services.embeddings  -> parity and speed of each backend against PyTorch
+    texts = [t for t in PARITY_SAMPLE_TEXTS for _ in range(40)]
+    reference = _torch_embeddings()
+    print("torch", _benchmark(texts, reference))
+    for quantize in (False, True):
+        name = "onnx-int8" if quantize else "onnx"
+        backend = OnnxEmbeddings(quantize=quantize)
+        print(name, _benchmark(texts, backend),
+              "min cosine", round(check_embedding_parity(backend, reference), 4))
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import logging
+import tempfile
+from typing import Optional, Dict, Any, Set
+
+logger = logging.getLogger(__name__)
+
+# Layout of the persisted index root:
+#   faiss_index/
+#       CURRENT.json           -> {"version": "<id>", "published_at": <ts>}
+#       versions/<id>/         -> immutable snapshot (index.faiss + index.pkl)
+#       leases/<worker>.json   -> {"version": "<id>", "heartbeat": <ts>}
+# A root without CURRENT.json is treated as a legacy single-directory index.
+DEFAULT_INDEX_ROOT = "faiss_index"
+MANIFEST_NAME = "CURRENT.json"
+VERSIONS_DIR = "versions"
+LEASES_DIR = "leases"
+
+# Workers refresh their lease every poll; a lease older than this is considered dead.
+LEASE_TTL_SECONDS = float(os.getenv("INDEX_LEASE_TTL", "120"))
+
+
+def _manifest_path(root: str) -> str:
+    return os.path.join(root, MANIFEST_NAME)
+
+
+def write_json_atomic(path: str, payload: Dict[str, Any]) -> None:
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(payload, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def new_version_id() -> str:
+    # Millisecond prefix keeps versions sortable by publish order.
+    return f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+
+
+def snapshot_path(version: str, root: str = DEFAULT_INDEX_ROOT) -> str:
+    return os.path.join(root, VERSIONS_DIR, version)
+
+
+def current_version(root: str = DEFAULT_INDEX_ROOT) -> Optional[str]:
+    manifest = read_json(_manifest_path(root))
+    if not manifest:
+        return None
+    return manifest.get("version")
+
+
+def current_snapshot_path(root: str = DEFAULT_INDEX_ROOT) -> Optional[str]:
+    """
+    Directory holding the index every worker should be serving, or None if nothing was ever built.
+    Falls back to the legacy layout where index.faiss/index.pkl live directly in the root.
+    """
+    version = current_version(root)
+    if version:
+        return snapshot_path(version, root)
+    if os.path.exists(os.path.join(root, "index.faiss")) and os.path.exists(os.path.join(root, "index.pkl")):
+        return root
+    return None
+
+
+def new_staging_dir(root: str = DEFAULT_INDEX_ROOT) -> str:
+    # Staged inside the root so the final os.replace never crosses filesystems.
+    os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix=".staging-", dir=root)
+
+
+def discard_staging_dirs(root: str = DEFAULT_INDEX_ROOT) -> None:
+    """
+    Remove leftovers of builds that crashed before install_snapshot. Only call this while
+    holding the writer lock: a build in progress does not touch its directory's mtime.
+    """
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        if name.startswith(".staging-"):
+            discard_dir(os.path.join(root, name))
+
+
+def install_snapshot(staging_dir: str, version: Optional[str] = None, root: str = DEFAULT_INDEX_ROOT) -> str:
+    """Move a fully written staging directory into versions/ without making it current."""
+    version = version or new_version_id()
+    os.makedirs(os.path.join(root, VERSIONS_DIR), exist_ok=True)
+    os.replace(staging_dir, snapshot_path(version, root))
+    return version
+
+
+def set_current_version(version: str, root: str = DEFAULT_INDEX_ROOT) -> None:
+    if not os.path.isdir(snapshot_path(version, root)):
+        raise RuntimeError(f"Cannot publish missing snapshot {version}")
+    write_json_atomic(_manifest_path(root), {"version": version, "published_at": time.time()})
+    logger.info("Published FAISS snapshot %s", version)
+
+
+def publish_snapshot(staging_dir: str, root: str = DEFAULT_INDEX_ROOT) -> str:
+    version = install_snapshot(staging_dir, root=root)
+    set_current_version(version, root)
+    return version
+
+
+def discard_dir(path: str) -> None:
+    if path and os.path.exists(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def write_lease(version: str, root: str = DEFAULT_INDEX_ROOT) -> None:
+    write_json_atomic(
+        os.path.join(root, LEASES_DIR, f"{worker_id()}.json"),
+        {"version": version, "heartbeat": time.time()},
+    )
+
+
+def release_lease(root: str = DEFAULT_INDEX_ROOT) -> None:
+    try:
+        os.remove(os.path.join(root, LEASES_DIR, f"{worker_id()}.json"))
+    except FileNotFoundError:
+        pass
+
+
+def _live_lease_versions(root: str, now: float) -> Set[str]:
+    leases_dir = os.path.join(root, LEASES_DIR)
+    versions = set()
+    if not os.path.isdir(leases_dir):
+        return versions
+    for name in os.listdir(leases_dir):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(leases_dir, name)
+        lease = read_json(path)
+        if not lease or now - lease.get("heartbeat", 0) > LEASE_TTL_SECONDS:
+            # Dead worker; drop its lease so it stops pinning a snapshot.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        versions.add(lease.get("version"))
+    return versions
+
+
+def collect_garbage(root: str = DEFAULT_INDEX_ROOT) -> int:
+    """
+    Delete snapshots that are neither current nor leased by a live worker.
+    Snapshots younger than the lease TTL are kept so a worker that has just read the
+    manifest has time to load and lease them. Staging directories are left to the writer
+    (see discard_staging_dirs).
+    """
+    versions_dir = os.path.join(root, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return 0
+
+    now = time.time()
+    keep = _live_lease_versions(root, now)
+    keep.add(current_version(root))
+
+    removed = 0
+    for version in os.listdir(versions_dir):
+        path = os.path.join(versions_dir, version)
+        if version in keep:
+            continue
+        try:
+            if now - os.path.getmtime(path) < LEASE_TTL_SECONDS:
+                continue
+        except FileNotFoundError:
+            continue
+        discard_dir(path)
+        removed += 1
+        logger.info("Garbage-collected FAISS snapshot %s", version)
+    return removed
@@ -0,0 +1,294 @@
+import os
+import uuid
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any
+
+from filelock import FileLock
+
+from services import index_store
+from services.embeddings import build_snapshot
+from databases.update_db import (
+    begin_write,
+    insert_chunks,
+    delete_chunks_by_document_id,
+    get_all_chunks,
+    count_chunks,
+    ensure_tables,
+    record_index_commit,
+    get_index_commit,
+    get_document_by_hash,
+    record_document_hash,
+)
+
+logger = logging.getLogger(__name__)
+
+# Write-ahead manifest describing the commit in progress; present only between
+# "intent recorded" and "snapshot published".
+WAL_NAME = "WAL.json"
+LOCK_NAME = ".writer.lock"
+
+# How many queued uploads one index write may absorb, and how long the writer waits for
+# stragglers before committing.
+MAX_BATCH_SIZE = int(os.getenv("INDEX_WRITER_MAX_BATCH", "16"))
+COALESCE_WINDOW_SECONDS = float(os.getenv("INDEX_WRITER_COALESCE_WINDOW", "0.05"))
+
+
+@dataclass
+class IngestBatch:
+    document_id: str
+    title: str
+    chunks: List[Dict[str, Any]]
+    replace: bool = False
+    content_hash: Optional[str] = None
+    future: Future = field(default_factory=Future)
+
+
+def _wal_path(persist_dir: str) -> str:
+    return os.path.join(persist_dir, WAL_NAME)
+
+
+def _lock(persist_dir: str) -> FileLock:
+    # Cross-process: uvicorn workers share the same index root.
+    os.makedirs(persist_dir, exist_ok=True)
+    return FileLock(os.path.join(persist_dir, LOCK_NAME))
+
+
+def _rebuild_from_db(persist_dir: str) -> str:
+    staging_dir = index_store.new_staging_dir(persist_dir)
+    try:
+        build_snapshot(get_all_chunks(), staging_dir)
+        return index_store.publish_snapshot(staging_dir, persist_dir)
+    except Exception:
+        index_store.discard_dir(staging_dir)
+        raise
+
+
+def _indexed_count(persist_dir: str) -> Optional[int]:
+    import faiss
+
+    snapshot_dir = index_store.current_snapshot_path(persist_dir)
+    if snapshot_dir is None:
+        return None
+    return faiss.read_index(os.path.join(snapshot_dir, "index.faiss")).ntotal
+
+
+def _recover_wal(persist_dir: str) -> None:
+    """
+    Finish or roll back a commit left behind by a crashed writer. The WAL only exists while the
+    writer lock is held, so finding one under the lock means its writer died mid-commit.
+    Any staging directory found under the lock is likewise a crashed build's leftover.
+    """
+    index_store.discard_staging_dirs(persist_dir)
+
+    wal = index_store.read_json(_wal_path(persist_dir))
+    if not wal:
+        return
+
+    version = wal["version"]
+    if get_index_commit(wal["txn_id"]):
+        # Rows are committed; finish publishing the matching snapshot.
+        if os.path.isdir(index_store.snapshot_path(version, persist_dir)):
+            index_store.set_current_version(version, persist_dir)
+        else:
+            _rebuild_from_db(persist_dir)
+        logger.info("Recovered index commit %s", wal["txn_id"])
+    else:
+        # SQLite rolled back; the snapshot (if any) must never be served.
+        index_store.discard_dir(index_store.snapshot_path(version, persist_dir))
+        logger.info("Discarded uncommitted index write %s", wal["txn_id"])
+    os.remove(_wal_path(persist_dir))
+
+
+def reconcile(persist_dir: str = index_store.DEFAULT_INDEX_ROOT) -> None:
+    """
+    Bring SQLite and the FAISS snapshot back in line after a crash. Safe to run from every
+    worker at startup: the writer lock makes the first one do the work.
+    """
+    ensure_tables()
+
+    with _lock(persist_dir):
+        _recover_wal(persist_dir)
+
+        rows = count_chunks()
+        indexed = _indexed_count(persist_dir)
+        if rows and indexed != rows:
+            logger.warning("FAISS holds %s vectors but SQLite has %s chunks; rebuilding index", indexed, rows)
+            _rebuild_from_db(persist_dir)
+
+
+def _follow(source: Future, target: Future) -> None:
+    # Resolve a duplicate upload with the outcome of the identical upload queued before it.
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(dict(source.result(), deduplicated=True))
+
+
+class IndexWriter:
+    """
+    Single writer for SQLite chunk rows and FAISS snapshots.
+    Uploads are queued; the writer thread drains whatever is pending and commits it as one
+    SQLite transaction plus one new snapshot, so N concurrent uploads cost one index write.
+    """
+
+    def __init__(self, persist_dir: str = index_store.DEFAULT_INDEX_ROOT):
+        self.persist_dir = persist_dir
+        self._queue: "queue.Queue[IngestBatch]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, document_id: str, title: str, chunks: List[Dict[str, Any]], replace: bool = False,
+               content_hash: Optional[str] = None) -> Future:
+        self._ensure_started()
+        batch = IngestBatch(document_id=document_id, title=title, chunks=chunks, replace=replace,
+                            content_hash=content_hash)
+        self._queue.put(batch)
+        return batch.future
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="index-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            while len(pending) < MAX_BATCH_SIZE:
+                try:
+                    pending.append(self._queue.get(timeout=COALESCE_WINDOW_SECONDS))
+                except queue.Empty:
+                    break
+
+            try:
+                version = self._commit(pending)
+            except Exception as e:
+                logger.exception("Index commit failed for %d upload(s)", len(pending))
+                for batch in pending:
+                    if not batch.future.done():
+                        batch.future.set_exception(e)
+                continue
+
+            for batch in pending:
+                # Duplicates were already answered inside _commit
+                if not batch.future.done():
+                    batch.future.set_result({
+                        "document_id": batch.document_id,
+                        "chunks_count": len(batch.chunks),
+                        "version": version,
+                        "deduplicated": False,
+                    })
+
+    def _drop_duplicates(self, pending: List[IngestBatch]) -> List[IngestBatch]:
+        """
+        Answer uploads whose file is already ingested (or queued earlier in this batch) with the
+        existing document instead of indexing it again. Runs under the writer lock, so two
+        workers receiving the same file concurrently still ingest it once.
+        """
+        fresh = []
+        seen: Dict[str, IngestBatch] = {}
+        for batch in pending:
+            if batch.content_hash is None:
+                fresh.append(batch)
+                continue
+
+            existing = get_document_by_hash(batch.content_hash)
+            if existing and (not batch.replace or existing["document_id"] == batch.document_id):
+                batch.future.set_result(dict(existing, version=index_store.current_version(self.persist_dir),
+                                             deduplicated=True))
+                continue
+
+            earlier = seen.get(batch.content_hash)
+            if earlier is not None and not batch.replace:
+                earlier.future.add_done_callback(lambda f, b=batch: _follow(f, b.future))
+                continue
+
+            seen[batch.content_hash] = batch
+            fresh.append(batch)
+        return fresh
+
+    def _commit(self, pending: List[IngestBatch]) -> Optional[str]:
+        persist_dir = self.persist_dir
+        txn_id = uuid.uuid4().hex
+        version = index_store.new_version_id()
+
+        with _lock(persist_dir):
+            # Another worker may have crashed mid-commit; build on its outcome, not over it.
+            _recover_wal(persist_dir)
+            pending = self._drop_duplicates(pending)
+            if not pending:
+                return index_store.current_version(persist_dir)
+
+            index_store.write_json_atomic(_wal_path(persist_dir), {
+                "txn_id": txn_id,
+                "version": version,
+                "document_ids": [b.document_id for b in pending],
+            })
+
+            new_chunks = [
+                dict(chunk, document_id=batch.document_id)
+                for batch in pending
+                for chunk in batch.chunks
+            ]
+            replaced = {batch.document_id for batch in pending if batch.replace}
+
+            # Embed before opening the SQLite transaction so conversation writes are not
+            # blocked for the duration of a rebuild. Holding the writer lock keeps the
+            # documents table stable in the meantime.
+            staging_dir = index_store.new_staging_dir(persist_dir)
+            try:
+                if replaced:
+                    # Replaced vectors cannot be removed by document id; rebuild from the resulting rows.
+                    kept = [c for c in get_all_chunks() if c["document_id"] not in replaced]
+                    build_snapshot(kept + new_chunks, staging_dir)
+                else:
+                    try:
+                        build_snapshot(new_chunks, staging_dir, base_path=index_store.current_snapshot_path(persist_dir))
+                    except Exception as e:
+                        # Never publish fewer vectors than SQLite holds: rebuild everything instead.
+                        logger.warning(f"Could not extend current FAISS snapshot, rebuilding from SQLite: {e}")
+                        build_snapshot(get_all_chunks() + new_chunks, staging_dir)
+                index_store.install_snapshot(staging_dir, version, persist_dir)
+
+                conn = begin_write()
+                try:
+                    for document_id in replaced:
+                        delete_chunks_by_document_id(document_id, conn=conn)
+                    for batch in pending:
+                        insert_chunks(batch.document_id, batch.title, batch.chunks, conn=conn)
+                        if batch.content_hash:
+                            record_document_hash(batch.content_hash, batch.document_id, batch.title, conn)
+                    record_index_commit(txn_id, version, conn)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.close()
+            except Exception:
+                index_store.discard_dir(staging_dir)
+                index_store.discard_dir(index_store.snapshot_path(version, persist_dir))
+                os.remove(_wal_path(persist_dir))
+                raise
+
+            index_store.set_current_version(version, persist_dir)
+            os.remove(_wal_path(persist_dir))
+
+        logger.info("Committed %d upload(s) as FAISS snapshot %s", len(pending), version)
+        return version
+
+
+_writer: Optional[IndexWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_index_writer() -> IndexWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = IndexWriter()
+        return _writer
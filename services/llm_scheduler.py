@@ -0,0 +1,174 @@
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Deque, List, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# Generations allowed to run against Ollama at once. The scheduler lives in each worker process,
+# so N uvicorn workers allow up to N times this many.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+# Requests allowed to wait for a slot in this worker, in total and per user
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_MAX_QUEUE_PER_USER = int(os.getenv("LLM_MAX_QUEUE_PER_USER", "4"))
+
+PRIORITY_NORMAL = 0
+PRIORITY_FOLLOW_UP = 1
+
+
+class QueueFullError(Exception):
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class Ticket:
+    """A request's place in the scheduler: waiting, then running, then released."""
+
+    def __init__(self, scheduler: "LLMScheduler", user_id: str, priority: int):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.priority = priority
+        self.granted = False
+        self.released = False
+        self.started_at: Optional[float] = None
+
+    async def wait(self) -> AsyncIterator[int]:
+        """Yield this ticket's 1-based queue position whenever it changes; return once a slot is granted."""
+        last_position = None
+        while not self.granted:
+            position = self.scheduler.position(self)
+            if position != last_position:
+                last_position = position
+                yield position
+            await self.scheduler.wait_for_change()
+
+    def release(self) -> None:
+        self.scheduler._release(self)
+
+
+class LLMScheduler:
+    """
+    Admission control for LLM generations.
+    At most max_concurrency tickets run at once; the rest wait in a bounded queue that is
+    served by priority tier first and round-robin across users within a tier, so one user's
+    burst cannot starve everyone else. All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 max_queue_per_user: int = LLM_MAX_QUEUE_PER_USER):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self._running = 0
+        # priority -> user_id -> waiting tickets; OrderedDict order is the round-robin order
+        self._waiting: Dict[int, "OrderedDict[str, Deque[Ticket]]"] = {}
+        self._queued = 0
+        # Created lazily so it binds to the running loop, not whichever loop existed at import
+        self._changed: Optional[asyncio.Event] = None
+        # Moving average of generation time, used for Retry-After hints
+        self._avg_seconds = 10.0
+
+    def submit(self, user_id: str, priority: int = PRIORITY_NORMAL) -> Ticket:
+        """Admit a request or raise QueueFullError straight away so the caller can answer 429/503."""
+        ticket = Ticket(self, user_id, priority)
+
+        if self._running < self.max_concurrency and self._queued == 0:
+            self._grant(ticket)
+            return ticket
+
+        user_queued = sum(len(users.get(user_id, ())) for users in self._waiting.values())
+        if user_queued >= self.max_queue_per_user:
+            raise QueueFullError(429, self.retry_after(user_queued), "Too many pending requests for this user")
+        if self._queued >= self.max_queue:
+            raise QueueFullError(503, self.retry_after(self._queued), "Server is busy, please retry shortly")
+
+        self._waiting.setdefault(priority, OrderedDict()).setdefault(user_id, deque()).append(ticket)
+        self._queued += 1
+        self._notify()
+        return ticket
+
+    def retry_after(self, queued: int) -> int:
+        return max(1, math.ceil((queued + 1) / self.max_concurrency * self._avg_seconds))
+
+    def _order(self) -> List[Ticket]:
+        """Waiting tickets in the order they would be granted."""
+        order = []
+        for priority in sorted(self._waiting, reverse=True):
+            queues = [list(q) for q in self._waiting[priority].values()]
+            for i in range(max((len(q) for q in queues), default=0)):
+                order.extend(q[i] for q in queues if i < len(q))
+        return order
+
+    def position(self, ticket: Ticket) -> int:
+        try:
+            return self._order().index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def _pop_next(self) -> Optional[Ticket]:
+        for priority in sorted(self._waiting, reverse=True):
+            users = self._waiting[priority]
+            if not users:
+                continue
+            user_id, queue = next(iter(users.items()))
+            ticket = queue.popleft()
+            if queue:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            self._queued -= 1
+            return ticket
+        return None
+
+    def _grant(self, ticket: Ticket) -> None:
+        ticket.granted = True
+        ticket.started_at = time.perf_counter()
+        self._running += 1
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_concurrency:
+            ticket = self._pop_next()
+            if ticket is None:
+                break
+            self._grant(ticket)
+        self._notify()
+
+    async def wait_for_change(self) -> None:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        await self._changed.wait()
+
+    def _notify(self) -> None:
+        # Wake every waiter so it can re-read its position; the next waiter arms a fresh event.
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def _release(self, ticket: Ticket) -> None:
+        if ticket.released:
+            return
+        ticket.released = True
+
+        if ticket.granted:
+            self._running -= 1
+            elapsed = time.perf_counter() - ticket.started_at
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+        else:
+            # Client went away while queued
+            users = self._waiting.get(ticket.priority, {})
+            queue = users.get(ticket.user_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del users[ticket.user_id]
+        self._dispatch()
+
+
+llm_scheduler = LLMScheduler()
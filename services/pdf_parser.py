@@ -1,7 +1,12 @@
 import fitz
+from typing import Optional, Union
 
-def pdf_extraction(file_path: str) -> list:
-    doc = fitz.Document(file_path)
+def pdf_extraction(file_path: Optional[str] = None, stream: Optional[Union[bytes, memoryview]] = None) -> list:
+    # Parse from disk, or from an upload's buffer; PyMuPDF uses bytes and memoryview without copying.
+    if stream is not None:
+        doc = fitz.open(stream=stream, filetype="pdf")
+    else:
+        doc = fitz.Document(file_path)
     print(f"Total number of pages: {doc.page_count}")
     page_texts = []
     for i, page in enumerate(doc):
@@ -1,22 +1,58 @@
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from transformers import pipeline
 import ollama
 import logging
 import sqlite3
 import json
-
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-#pipeline_model = pipeline("text-generation", model="microsoft/DialoGPT-medium")
+import os
+import threading
+import numpy as np
+from typing import Optional, Tuple, List, Dict
+from services import index_store
+from services.embeddings import get_embeddings
+
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+# How long Ollama keeps the model (and its prompt cache) loaded between requests
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# (version, vectorstore) currently served by this worker. Replaced as a whole on reload so
+# in-flight searches keep using the snapshot they started with. The embedding model and
+# FAISS are only imported/loaded on first use (or by the startup warm-up).
+_active_index: Tuple[Optional[str], Optional["FAISS"]] = (None, None)
+_load_lock = threading.Lock()
+
+def load_index(index_path: str = 'faiss_index', force: bool = False) -> Optional[str]:
+    """
+    Load the current snapshot into memory if it differs from the one being served.
+    Returns the version now active (None for a legacy unversioned index).
+    """
+    global _active_index
+
+    with _load_lock:
+        version = index_store.current_version(index_path)
+        active_version, active_vectors = _active_index
+        if active_vectors is not None and version == active_version and not force:
+            return active_version
+
+        snapshot_dir = index_store.current_snapshot_path(index_path)
+        if snapshot_dir is None:
+            raise RuntimeError(f"No FAISS index found under {index_path}")
+
+        from langchain_community.vectorstores import FAISS
+
+        vectors = FAISS.load_local(snapshot_dir, get_embeddings(), allow_dangerous_deserialization=True)
+        _active_index = (version, vectors)
+        logging.info("Serving FAISS snapshot %s", version or snapshot_dir)
+        return version
+
+def get_active_index(index_path: str = 'faiss_index') -> Tuple[Optional[str], "FAISS"]:
+    version, vectors = _active_index
+    if vectors is None:
+        load_index(index_path)
+        version, vectors = _active_index
+    return version, vectors
 
 def chunk_retrieval(question: str, index_path: str = 'faiss_index', k: int = 1):
 
-    print("Loading FAISS index from:", index_path)
-    
-    
-    vectors = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-    print("FAISS index loaded successfully")
+    _, vectors = get_active_index(index_path)
     print(f"Performing semantic search for: '{question}', top_k={k}")
 
     results = vectors.similarity_search(question, k=k)
@@ -34,6 +70,26 @@ def chunk_retrieval(question: str, index_path: str = 'faiss_index', k: int = 1):
 
     return similar_chunks
 
+def batch_chunk_retrieval(questions: List[str], index_path: str = 'faiss_index', k: int = 1) -> List[List[Dict]]:
+    """chunk_retrieval for many questions: one batched embedding call and one multi-query FAISS search."""
+    if not questions:
+        return []
+
+    _, vectors = get_active_index(index_path)
+    query_vectors = np.array(get_embeddings().embed_documents(questions), dtype=np.float32)
+    _, indices = vectors.index.search(query_vectors, k)
+
+    results = []
+    for row in indices:
+        similar_chunks = []
+        for i in row:
+            if i == -1:
+                continue
+            doc = vectors.docstore.search(vectors.index_to_docstore_id[i])
+            similar_chunks.append({"content": doc.page_content, "metadata": doc.metadata})
+        results.append(similar_chunks)
+    return results
+
 def llm_response(chunk: str, question: str):
     prompt = f"""You are an expert law consultant who is using the following from the constitution to answer the given question. Based on the chunk provided below, answer the question that the user is asking.
     
@@ -53,20 +109,56 @@ def llm_response(chunk: str, question: str):
     
     print("Sending Prompt to LLAMA...")
 
-
+    debug = logging.getLogger().isEnabledFor(logging.DEBUG)
     for token in ollama.chat(
-        model='llama3.2',
+        model=OLLAMA_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful and precise law assistant."},
             {"role": "user", "content": prompt}
-        ], stream=True
+        ], stream=True, keep_alive=OLLAMA_KEEP_ALIVE
     ):
         content = token.get("message", {}).get("content", "")
         if content:
-            logging.debug(f"Streaming token: {content}")
+            if debug:
+                logging.debug("Streaming token: %s", content)
             yield content
     logging.info("Streaming completed successfully.")
 
+def _chat_system_prompt(chunk_content: str) -> str:
+    # Identical for every turn of a conversation, so Ollama can reuse the prefilled prefix.
+    return f"""You are a helpful and precise law assistant, acting as an expert law consultant continuing a conversation. Answer the user's latest question based on the earlier turns of this conversation and the context below.
+
+Context: {chunk_content}
+
+Context is the information you used to base your answers on.
+
+While generating a response, please consider the following guidelines and guardrails -
+1. Continue the chat in a natural manner by ensuring that you are leveraging the earlier turns and Context.
+2. Use all the sources at your disposal but primarily consider the chunk provided.
+3. If the Context does not have the response to the follow-up question, then leverage additional sources at your disposal.
+4. Respond to questions like a legal professional and maintain that tone.
+5. DO NOT REPEAT THE QUESTION IN YOUR RESPONSE AND DO NOT FORM POLITICAL OPINIONS."""
+
+def _history_messages(raw_messages_json: Optional[str]) -> List[Dict[str, str]]:
+    """
+    Earlier turns as user/assistant messages, oldest first. Each turn renders the same way
+    every time, so turn N's prompt is a strict prefix of turn N+1's.
+    """
+    try:
+        parsed = json.loads(raw_messages_json) if raw_messages_json else {}
+    except (TypeError, ValueError):
+        return []
+
+    turns = list(parsed.get("History") or [])
+    if parsed.get("Content"):
+        turns.append(parsed["Content"])
+
+    messages = []
+    for turn in turns:
+        messages.append({"role": "user", "content": str(turn.get("Query", ""))})
+        messages.append({"role": "assistant", "content": str(turn.get("Response", ""))})
+    return messages
+
 def llm_chat_response(conversation_id: str, question: str):
     conn = sqlite3.connect('legal_ai.db')
     cursor = conn.cursor()
@@ -78,15 +170,7 @@ def llm_chat_response(conversation_id: str, question: str):
             raw_messages_json = row[0]
         else:
             raw_messages_json = None
-        
-        try:
-                parsed_messages = json.loads(raw_messages_json)
-                messages_json_str = json.dumps(parsed_messages)
-        except Exception:
-                messages_json_str = str(raw_messages_json) 
-            
 
-            
         cursor.execute("""
                         SELECT d.content
                         FROM documents d
@@ -98,39 +182,26 @@ def llm_chat_response(conversation_id: str, question: str):
         if result and result[0]:
             chunk_content = result[0]
         else:
-            return "Error: Chunk content not found"
-            
-        prompt = f"""You are an expert law consultant continuing a conversation. Based on the previous messages and the chunk provided below, answer the question that the user is asking.
-            
-            Previous Messages: {messages_json_str}
-            Context: {chunk_content}
-            Question: {question}
-
-            Please note the following - 
-            1. Previous messages has two keys - Content and History. Content is the latest interaction you had with the user and History is the historical chats starting from the earliest.
-            2. Context is the information you used to base your answers on.
-            3. Question is the user's latest question that you need to answer based on Previous Messages and Context.
-
-            While generating a response, please consider the following guidelines and guardrails -
-            1. Continue the chat in a natural manner by ensuring that you are leveraging Previous Messages and Context.
-            2. Use all the sources at your disposal but primarily consider the chunk provided.
-            3. If the Context does not have the response to the follow-up question, then leverage additional sources at your disposal.
-            4. Respond to questions like a legal professional and maintain that tone.
-            5. DO NOT REPEAT THE QUESTION IN YOUR RESPONSE AND DO NOT FORM POLITICAL OPINIONS."""
+            yield "Error: Chunk content not found"
+            return
+
+        messages = [{"role": "system", "content": _chat_system_prompt(chunk_content)}]
+        messages.extend(_history_messages(raw_messages_json))
+        messages.append({"role": "user", "content": question})
 
         print("Sending Prompt to LLAMA...")
 
-        
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
         for token in ollama.chat(
-            model = 'llama3.2',
-            messages=[
-                {"role": "system", "content": "You are a helpful and precise law assistant"},
-                {"role": "user", "content": prompt},
-            ], stream = True,
+            model = OLLAMA_MODEL,
+            messages=messages,
+            stream = True,
+            keep_alive = OLLAMA_KEEP_ALIVE,
         ):
                 content = token.get("message", {}).get("content", "")
                 if content:
-                    logging.debug("Streaming chat token for %s: %s", conversation_id, content)
+                    if debug:
+                        logging.debug("Streaming chat token for %s: %s", conversation_id, content)
                     yield content
         logging.info("Streaming completed successfully.")
     finally:
@@ -0,0 +1,77 @@
+import os
+import json
+import asyncio
+from typing import Any, AsyncIterator, Optional
+
+# Tokens are batched into one SSE frame until the oldest buffered token has waited this
+# long or the frame reaches SSE_MAX_FRAME_CHARS. Clients may ask for a different interval
+# (flush_ms), clamped to SSE_MAX_FLUSH_MS; 0 sends every token as soon as it arrives.
+SSE_FLUSH_MS = int(os.getenv("SSE_FLUSH_MS", "50"))
+SSE_MAX_FLUSH_MS = int(os.getenv("SSE_MAX_FLUSH_MS", "1000"))
+SSE_MAX_FRAME_CHARS = int(os.getenv("SSE_MAX_FRAME_CHARS", "2048"))
+
+DONE_EVENT = "data: [DONE]\n\n"
+
+
+def sse_event(payload: Any) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def flush_interval(requested_ms: Optional[int]) -> float:
+    """Seconds between frames for a request, honouring the client's flush_ms within limits."""
+    if requested_ms is None:
+        requested_ms = SSE_FLUSH_MS
+    return min(max(requested_ms, 0), SSE_MAX_FLUSH_MS) / 1000
+
+
+async def coalesce_tokens(tokens: AsyncIterator[str], interval: float,
+                          max_chars: int = SSE_MAX_FRAME_CHARS) -> AsyncIterator[str]:
+    """
+    Re-chunk a token stream into larger pieces. A piece is emitted once its first token has
+    waited interval seconds (even if no new token arrives), when it reaches max_chars, or
+    when the stream ends. Joining the pieces gives back the original text.
+    """
+    if interval <= 0:
+        async for token in tokens:
+            yield token
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = tokens.__aiter__()
+    buffer = []
+    size = 0
+    deadline = None
+    pending = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                yield "".join(buffer)
+                buffer, size, deadline = [], 0, None
+                continue
+
+            finished, pending = pending, None
+            try:
+                token = finished.result()
+            except StopAsyncIteration:
+                break
+
+            buffer.append(token)
+            size += len(token)
+            if deadline is None:
+                deadline = loop.time() + interval
+            if size >= max_chars:
+                yield "".join(buffer)
+                buffer, size, deadline = [], 0, None
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,95 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Any
+
+import ollama
+from starlette.concurrency import run_in_threadpool
+
+from services import index_store
+from services.embeddings import get_embeddings
+from services.index_writer import reconcile
+from services.query_engine import load_index, get_active_index, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE
+
+logger = logging.getLogger(__name__)
+
+# Also load the Ollama model during warm-up so the first answer does not pay for it.
+WARMUP_PING_OLLAMA = os.getenv("WARMUP_PING_OLLAMA", "1") == "1"
+
+# A failed warm-up is retried after this many seconds, doubling up to the cap.
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+WARMUP_RETRY_MAX_SECONDS = float(os.getenv("WARMUP_RETRY_MAX_SECONDS", "300"))
+
+# Read by /readyz. Only the warm-up thread writes it.
+_state: Dict[str, Any] = {"ready": False, "phase": "starting", "warmed_index_version": None, "ollama": None, "error": None,
+                          "retry_in_seconds": None}
+
+# Set once crash recovery has run; the index watcher does not serve a snapshot before then.
+index_reconciled = threading.Event()
+
+
+def readiness() -> Dict[str, Any]:
+    return dict(_state)
+
+
+def warm_up(persist_dir: str = index_store.DEFAULT_INDEX_ROOT, ping_ollama: bool = WARMUP_PING_OLLAMA) -> bool:
+    """
+    Finish or roll back any index commit interrupted by a crash, then pay every first-request
+    cost up front: embedding model load, a dummy encode, FAISS load and a dummy search, and
+    optionally loading the LLM into Ollama. The worker reports ready after
+    this returns True, even without an index (uploads create one) or without Ollama (reported as such).
+    """
+    start = time.perf_counter()
+    try:
+        # Before the index phase, so warm-up never loads a snapshot the database disagrees with.
+        _state["phase"] = "reconcile"
+        reconcile(persist_dir)
+        index_reconciled.set()
+
+        _state["phase"] = "embedding_model"
+        query_vector = get_embeddings().embed_query("warm-up")
+
+        if index_store.current_snapshot_path(persist_dir):
+            _state["phase"] = "index"
+            _state["warmed_index_version"] = load_index(persist_dir)
+            _, vectors = get_active_index(persist_dir)
+            vectors.similarity_search_by_vector(query_vector, k=1)
+        else:
+            logger.info("No FAISS index yet; skipping index warm-up")
+
+        if ping_ollama:
+            _state["phase"] = "ollama"
+            try:
+                # An empty prompt loads the model without generating anything.
+                ollama.generate(model=OLLAMA_MODEL, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+                _state["ollama"] = "ok"
+            except Exception as e:
+                logger.warning(f"Ollama warm-up failed: {e}")
+                _state["ollama"] = f"unavailable: {e}"
+
+        _state["phase"] = "done"
+        _state["ready"] = True
+        _state["error"] = None
+        logger.info(f"Warm-up finished - Time taken: {time.perf_counter() - start:.4f} seconds")
+        return True
+    except Exception as e:
+        logger.exception("Warm-up failed")
+        _state["phase"] = "failed"
+        _state["error"] = str(e)
+        return False
+
+
+async def warm_up_until_ready(persist_dir: str = index_store.DEFAULT_INDEX_ROOT) -> None:
+    """
+    Run warm_up() in the threadpool until it succeeds, backing off between attempts, so a
+    transient failure (model download, disk, database) does not leave the worker unready forever.
+    """
+    delay = WARMUP_RETRY_SECONDS
+    while not await run_in_threadpool(warm_up, persist_dir):
+        logger.info(f"Retrying warm-up in {delay:.0f} seconds")
+        _state["retry_in_seconds"] = delay
+        await asyncio.sleep(delay)
+        _state["retry_in_seconds"] = None
+        delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
@@ -0,0 +1,55 @@
+import os
+import time
+
+from services import index_store
+
+
+def make_snapshot(root, version, age=0.0):
+    path = index_store.snapshot_path(version, root)
+    os.makedirs(path)
+    if age:
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+    return path
+
+
+def write_lease(root, name, version, age=0.0):
+    index_store.write_json_atomic(
+        os.path.join(root, index_store.LEASES_DIR, f"{name}.json"),
+        {"version": version, "heartbeat": time.time() - age},
+    )
+
+
+def test_collect_garbage_keeps_current_leased_and_young_snapshots(tmp_path):
+    root = str(tmp_path)
+    old = index_store.LEASE_TTL_SECONDS * 2
+
+    make_snapshot(root, "current", age=old)
+    index_store.set_current_version("current", root)
+    make_snapshot(root, "leased", age=old)
+    write_lease(root, "live-worker", "leased")
+    make_snapshot(root, "young")
+    make_snapshot(root, "orphaned", age=old)
+    make_snapshot(root, "dead-lease", age=old)
+    write_lease(root, "dead-worker", "dead-lease", age=old)
+
+    removed = index_store.collect_garbage(root)
+
+    assert removed == 2
+    assert sorted(os.listdir(os.path.join(root, index_store.VERSIONS_DIR))) == ["current", "leased", "young"]
+    assert os.listdir(os.path.join(root, index_store.LEASES_DIR)) == ["live-worker.json"]
+
+
+def test_collect_garbage_leaves_staging_dirs_to_the_writer(tmp_path):
+    root = str(tmp_path)
+    make_snapshot(root, "current")
+    index_store.set_current_version("current", root)
+    staging_dir = index_store.new_staging_dir(root)
+    stamp = time.time() - index_store.LEASE_TTL_SECONDS * 2
+    os.utime(staging_dir, (stamp, stamp))
+
+    index_store.collect_garbage(root)
+    assert os.path.isdir(staging_dir)
+
+    index_store.discard_staging_dirs(root)
+    assert not os.path.exists(staging_dir)
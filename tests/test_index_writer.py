@@ -0,0 +1,184 @@
+import os
+import json
+import sqlite3
+
+import pytest
+
+from databases import update_db
+from services import index_store
+from services import index_writer
+from services.index_writer import IndexWriter, IngestBatch, reconcile
+
+
+class Crash(BaseException):
+    """Simulates the process dying: not an Exception, so the writer's cleanup does not run."""
+
+
+def fake_build_snapshot(chunks, staging_dir, base_path=None, document_id=None):
+    # Stands in for FAISS: a snapshot is just the list of chunk contents it holds.
+    contents = []
+    if base_path:
+        with open(os.path.join(base_path, "chunks.json")) as f:
+            contents = json.load(f)
+    contents += [chunk["content"] for chunk in chunks]
+    with open(os.path.join(staging_dir, "chunks.json"), "w") as f:
+        json.dump(contents, f)
+    return len(contents)
+
+
+def snapshot_contents(root):
+    path = index_store.current_snapshot_path(root)
+    if path is None:
+        return None
+    with open(os.path.join(path, "chunks.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "legal_ai.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+    CREATE TABLE documents (
+        document_id TEXT,
+        chunk_id TEXT,
+        title,
+        page_number INTEGER,
+        chunk_index INTEGER,
+        content TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (document_id, chunk_id)
+    )
+    """)
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(update_db, "DB_PATH", db_path)
+    monkeypatch.setattr(index_writer, "build_snapshot", fake_build_snapshot)
+    monkeypatch.setattr(index_writer, "_indexed_count", lambda root: (
+        None if snapshot_contents(root) is None else len(snapshot_contents(root))
+    ))
+    update_db.ensure_tables()
+    return str(tmp_path / "faiss_index")
+
+
+def chunks(*contents):
+    return [{"page_number": 1, "chunk_index": i, "content": c} for i, c in enumerate(contents)]
+
+
+def commit(root, document_id, *contents):
+    return IndexWriter(root)._commit([IngestBatch(document_id=document_id, title=document_id, chunks=chunks(*contents))])
+
+
+def test_commit_publishes_rows_and_snapshot_together(root):
+    version = commit(root, "doc-a", "a1", "a2")
+
+    assert index_store.current_version(root) == version
+    assert snapshot_contents(root) == ["a1", "a2"]
+    assert update_db.count_chunks() == 2
+    assert not os.path.exists(os.path.join(root, index_writer.WAL_NAME))
+
+
+def test_crash_before_snapshot_install_is_discarded(root, monkeypatch):
+    commit(root, "doc-a", "a1")
+    with monkeypatch.context() as m:
+        m.setattr(index_store, "install_snapshot", lambda *args, **kwargs: (_ for _ in ()).throw(Crash()))
+        with pytest.raises(Crash):
+            commit(root, "doc-b", "b1")
+
+    reconcile(root)
+
+    assert snapshot_contents(root) == ["a1"]
+    assert update_db.count_chunks() == 1
+    assert not os.path.exists(os.path.join(root, index_writer.WAL_NAME))
+
+
+def test_crash_after_snapshot_install_before_sqlite_commit_is_rolled_back(root, monkeypatch):
+    first = commit(root, "doc-a", "a1")
+    with monkeypatch.context() as m:
+        m.setattr(index_writer, "begin_write", lambda: (_ for _ in ()).throw(Crash()))
+        with pytest.raises(Crash):
+            commit(root, "doc-b", "b1")
+    wal = index_store.read_json(os.path.join(root, index_writer.WAL_NAME))
+    assert os.path.isdir(index_store.snapshot_path(wal["version"], root))
+
+    reconcile(root)
+
+    assert index_store.current_version(root) == first
+    assert snapshot_contents(root) == ["a1"]
+    assert update_db.count_chunks() == 1
+    assert not os.path.isdir(index_store.snapshot_path(wal["version"], root))
+    assert not os.path.exists(os.path.join(root, index_writer.WAL_NAME))
+
+
+def test_crash_after_sqlite_commit_before_publish_is_rolled_forward(root, monkeypatch):
+    commit(root, "doc-a", "a1")
+    with monkeypatch.context() as m:
+        m.setattr(index_store, "set_current_version", lambda *args, **kwargs: (_ for _ in ()).throw(Crash()))
+        with pytest.raises(Crash):
+            commit(root, "doc-b", "b1")
+    wal = index_store.read_json(os.path.join(root, index_writer.WAL_NAME))
+    assert update_db.count_chunks() == 2
+    assert snapshot_contents(root) == ["a1"]
+
+    reconcile(root)
+
+    assert index_store.current_version(root) == wal["version"]
+    assert snapshot_contents(root) == ["a1", "b1"]
+    assert not os.path.exists(os.path.join(root, index_writer.WAL_NAME))
+
+
+def test_committed_write_with_missing_snapshot_is_rebuilt_from_sqlite(root, monkeypatch):
+    commit(root, "doc-a", "a1")
+    with monkeypatch.context() as m:
+        m.setattr(index_store, "set_current_version", lambda *args, **kwargs: (_ for _ in ()).throw(Crash()))
+        with pytest.raises(Crash):
+            commit(root, "doc-b", "b1")
+    wal = index_store.read_json(os.path.join(root, index_writer.WAL_NAME))
+    index_store.discard_dir(index_store.snapshot_path(wal["version"], root))
+
+    reconcile(root)
+
+    assert sorted(snapshot_contents(root)) == ["a1", "b1"]
+
+
+def test_reconcile_rebuilds_when_counts_disagree(root):
+    commit(root, "doc-a", "a1")
+    conn = sqlite3.connect(update_db.DB_PATH)
+    conn.execute("INSERT INTO documents (document_id, chunk_id, title, page_number, chunk_index, content) "
+                 "VALUES ('doc-x', 'x', 'x', 1, 0, 'x1')")
+    conn.commit()
+    conn.close()
+
+    reconcile(root)
+
+    assert sorted(snapshot_contents(root)) == ["a1", "x1"]
+
+
+def test_concurrent_submits_coalesce_into_one_snapshot(root, monkeypatch):
+    monkeypatch.setattr(index_writer, "COALESCE_WINDOW_SECONDS", 0.5)
+    writer = IndexWriter(root)
+
+    first = writer.submit("doc-a", "A", chunks("a1"))
+    second = writer.submit("doc-b", "B", chunks("b1", "b2"))
+    results = [first.result(timeout=10), second.result(timeout=10)]
+
+    assert results[0]["version"] == results[1]["version"] == index_store.current_version(root)
+    assert sorted(snapshot_contents(root)) == ["a1", "b1", "b2"]
+    assert os.listdir(os.path.join(root, index_store.VERSIONS_DIR)) == [results[0]["version"]]
+    assert update_db.count_chunks() == 3
+
+
+def test_next_commit_recovers_a_crashed_writer_before_building_on_it(root, monkeypatch):
+    commit(root, "doc-a", "a1")
+    with monkeypatch.context() as m:
+        m.setattr(index_store, "set_current_version", lambda *args, **kwargs: (_ for _ in ()).throw(Crash()))
+        with pytest.raises(Crash):
+            commit(root, "doc-b", "b1")
+
+    # A surviving worker commits without reconcile() having run.
+    commit(root, "doc-c", "c1")
+
+    assert snapshot_contents(root) == ["a1", "b1", "c1"]
+    assert update_db.count_chunks() == 3
+    assert not os.path.exists(os.path.join(root, index_writer.WAL_NAME))
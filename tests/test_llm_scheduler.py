@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from services.llm_scheduler import LLMScheduler, QueueFullError, PRIORITY_FOLLOW_UP
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_admits_immediately_while_slots_are_free():
+    scheduler = LLMScheduler(max_concurrency=2, max_queue=4, max_queue_per_user=2)
+
+    first = scheduler.submit("alice")
+    second = scheduler.submit("bob")
+    third = scheduler.submit("carol")
+
+    assert first.granted and second.granted
+    assert not third.granted
+    assert scheduler.position(third) == 1
+
+
+def test_waiting_tickets_are_served_round_robin_by_user_and_priority_first():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=10, max_queue_per_user=5)
+    scheduler.submit("alice")
+
+    a1 = scheduler.submit("alice")
+    a2 = scheduler.submit("alice")
+    b1 = scheduler.submit("bob")
+    c1 = scheduler.submit("carol", PRIORITY_FOLLOW_UP)
+
+    assert scheduler._order() == [c1, a1, b1, a2]
+    assert [scheduler.position(t) for t in (c1, a1, b1, a2)] == [1, 2, 3, 4]
+
+
+def test_grants_follow_the_queue_order_as_slots_free_up():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=10, max_queue_per_user=5)
+    running = scheduler.submit("alice")
+    a1 = scheduler.submit("alice")
+    a2 = scheduler.submit("alice")
+    b1 = scheduler.submit("bob")
+
+    granted = []
+    for ticket in (running, a1, b1, a2):
+        ticket.release()
+        granted.append(next((t for t in (a1, a2, b1) if t.granted and t not in granted), None))
+
+    assert granted == [a1, b1, a2, None]
+
+
+def test_per_user_limit_answers_429_and_global_limit_answers_503():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=3, max_queue_per_user=2)
+    scheduler.submit("alice")
+    scheduler.submit("alice")
+    scheduler.submit("alice")
+
+    with pytest.raises(QueueFullError) as per_user:
+        scheduler.submit("alice")
+    assert per_user.value.status_code == 429
+    assert per_user.value.retry_after >= 1
+
+    scheduler.submit("bob")
+    with pytest.raises(QueueFullError) as global_limit:
+        scheduler.submit("carol")
+    assert global_limit.value.status_code == 503
+    assert global_limit.value.retry_after >= 1
+
+
+def test_releasing_a_queued_ticket_frees_its_place():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=2, max_queue_per_user=2)
+    running = scheduler.submit("alice")
+    queued = scheduler.submit("bob")
+    behind = scheduler.submit("carol")
+
+    queued.release()
+
+    assert not queued.granted
+    assert scheduler.position(behind) == 1
+    scheduler.submit("dave")
+
+    running.release()
+    assert behind.granted
+    assert scheduler._running == 1
+
+
+def test_release_is_idempotent():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=2, max_queue_per_user=2)
+    ticket = scheduler.submit("alice")
+
+    ticket.release()
+    ticket.release()
+
+    assert scheduler._running == 0
+
+
+def test_wait_reports_positions_until_granted():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=5, max_queue_per_user=5)
+        running = scheduler.submit("alice")
+        first = scheduler.submit("bob")
+        second = scheduler.submit("carol")
+
+        positions = []
+
+        async def follow(ticket):
+            async for position in ticket.wait():
+                positions.append((ticket.user_id, position))
+
+        waiters = [asyncio.ensure_future(follow(first)), asyncio.ensure_future(follow(second))]
+        await asyncio.sleep(0)
+        running.release()
+        await waiters[0]
+        first.release()
+        await waiters[1]
+        return positions
+
+    positions = run(scenario())
+
+    assert ("bob", 1) in positions
+    assert [p for user, p in positions if user == "carol"] == [2, 1]